@@ -0,0 +1,48 @@
+// ======================================================================
+// Buildx bake definitions for CherryRecorder Server
+// ======================================================================
+// `docker buildx bake app|test` reproduces the build that
+// docker_manager.py assembles flag-by-flag; `docker_manager.py --bake`
+// delegates its build step to these targets. Cache settings mirror the
+// script: inline cache metadata plus a local .buildx-cache directory.
+
+variable "REGISTRY" {
+  // e.g. "ghcr.io/kugorang"; when set an extra registry-qualified tag is added
+  default = ""
+}
+
+variable "PLATFORMS" {
+  default = "linux/amd64"
+}
+
+variable "VCPKG_MAX_CONCURRENCY" {
+  default = "4"
+}
+
+function "tags_for" {
+  params = [name]
+  result = REGISTRY == "" ? ["${name}:latest"] : ["${name}:latest", "${REGISTRY}/${name}:latest"]
+}
+
+// Local cache directories are per target (same split as the
+// .docker_build_hash.<target> files) so app and test builds do not
+// evict each other's layers when the cache is rotated.
+target "app" {
+  dockerfile = "Dockerfile"
+  tags       = tags_for("cherryrecorder-server")
+  platforms  = split(",", PLATFORMS)
+  args = {
+    BUILDKIT_INLINE_CACHE = "1"
+    VCPKG_MAX_CONCURRENCY = VCPKG_MAX_CONCURRENCY
+  }
+  cache-from = ["type=local,src=.buildx-cache/app"]
+  cache-to   = ["type=local,dest=.buildx-cache/app-new,mode=max"]
+}
+
+target "test" {
+  inherits   = ["app"]
+  dockerfile = "Dockerfile.test"
+  tags       = tags_for("cherryrecorder-server-test")
+  cache-from = ["type=local,src=.buildx-cache/test"]
+  cache-to   = ["type=local,dest=.buildx-cache/test-new,mode=max"]
+}
@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import dataclasses
+import hashlib
+import http.client
+import json
+import logging
+import socket
 import subprocess
 import os
 import shutil
 import sys
+import threading
 import time
 import platform
+import urllib.parse
+import urllib.request
 
 # --- Configuration ---
 APP_IMAGE_TAG = "cherryrecorder-server:latest"
@@ -13,9 +23,20 @@ TEST_IMAGE_TAG = "cherryrecorder-server-test:latest"
 APP_CONTAINER_NAME = "cherryrecorder-server-container"
 APP_DOCKERFILE = "Dockerfile"
 TEST_DOCKERFILE = "Dockerfile.test"
+# BuildKit은 '-f Dockerfile.test'로 빌드할 때 'Dockerfile.test.dockerignore'를
+# 자동으로 사용하므로 .dockerignore를 바꿔치기할 필요가 없음
 TEST_DOCKERIGNORE = "Dockerfile.test.dockerignore"
 DEFAULT_DOCKERIGNORE = ".dockerignore"
-BACKUP_DOCKERIGNORE = ".dockerignore.original"
+# 데몬과 독립적인 파일 트리 형태의 buildx 레이어 캐시 디렉터리
+# (CI에서 actions/cache 등으로 저장/복원할 수 있음).
+# 타겟별 하위 디렉터리(app/test)를 사용해 서로의 캐시를 덮어쓰지 않음
+BUILDX_CACHE_DIR = ".buildx-cache"
+# 마지막 성공 빌드의 컨텍스트 해시를 기록하는 파일 (타겟별 접미사 추가)
+BUILD_HASH_FILE_PREFIX = ".docker_build_hash"
+# 이미지 내용에 영향을 주는 최상위 입력 파일들
+CONTEXT_HASH_FILES = ("vcpkg.json", "CMakeLists.txt",
+                      "x64-linux-ecs.cmake", "arm64-linux-ecs.cmake")
+CONTEXT_HASH_DIRS = ("src", "include", "tests")
 
 # --- Architecture Detection ---
 def get_current_arch():
@@ -42,108 +63,512 @@ ENV_FILE_ALTERNATIVES = [".env", "server-config.env", "../server-config.env"]
 # --- ECS t2.micro 환경 설정 ---
 IS_T2_MICRO = os.environ.get('ECS_INSTANCE_TYPE', '').lower() == 't2.micro'
 
+# 플랫폼은 실행 중 변하지 않으므로 한 번만 판정
+IS_WINDOWS = sys.platform == "win32"
+
+# --- App 컨테이너 run 옵션 (모듈 로드 시 한 번만 조립) ---
+# t2.micro 환경을 위한 리소스 제한:
+# 1GB RAM 중 시스템용 100MB 제외하고 900MB 할당,
+# swap 비활성화(성능 저하 방지), CPU 95% 사용(시스템 여유분 확보)
+_RESOURCE_LIMITS = [
+    "--memory", "900m",
+    "--memory-swap", "900m",
+    "--cpus", "0.95"
+]
+# ECS t2.micro 환경에서 추가 설정
+_ECS_LOG_OPTIONS = [
+    "--privileged",  # WSL2/ECS libevent 문제 해결
+    "--log-driver", "awslogs",
+    "--log-opt", "awslogs-group=/ecs/cherryrecorder-server",
+    "--log-opt", "awslogs-region=ap-northeast-2",
+    "--log-opt", "awslogs-stream=local-test",
+    "--restart", "unless-stopped"
+]
+# 로컬 개발 환경에서는 json-file 사용
+_LOCAL_LOG_OPTIONS = [
+    "--log-driver", "json-file",
+    "--log-opt", "max-size=10m",
+    "--log-opt", "max-file=3"
+]
+_PORT_MAP_OPTIONS = [
+    "-p", f"{HOST_PORT_HTTP}:{CONTAINER_PORT_HTTP}",
+    "-p", f"{HOST_PORT_CHAT}:{CONTAINER_PORT_CHAT}"
+]
+# IS_T2_MICRO는 임포트 시점에 확정되는 상수이므로 로그 드라이버 선택까지
+# 여기서 미리 특수화해 둠; main에서는 env-file 인자만 덧붙이면 됨
+APP_RUN_ARGS_BASE = (
+    ["docker", "run", "-d", "--name", APP_CONTAINER_NAME]
+    + _RESOURCE_LIMITS
+    + (_ECS_LOG_OPTIONS if IS_T2_MICRO else _LOCAL_LOG_OPTIONS)
+    + _PORT_MAP_OPTIONS
+)
+TEST_RUN_ARGS = ["docker", "run", "--rm", "-e", "GOOGLE_MAPS_API_KEY=dummy_key", TEST_IMAGE_TAG]
+
+# --- Logging ---
+log = logging.getLogger("docker_manager")
+
+def configure_logging(quiet=False):
+    """Routes INFO to stdout and WARNING+ to stderr (same split the old
+    print calls had), with --quiet dropping everything below WARNING."""
+    fmt = logging.Formatter("%(message)s")
+    out = logging.StreamHandler(sys.stdout)
+    out.addFilter(lambda record: record.levelno < logging.WARNING)
+    err = logging.StreamHandler(sys.stderr)
+    err.setLevel(logging.WARNING)
+    for handler in (out, err):
+        handler.setFormatter(fmt)
+    root = logging.getLogger()
+    root.handlers[:] = [out, err]
+    root.setLevel(logging.WARNING if quiet else logging.INFO)
+
+# --- Docker Engine API (unix socket) ---
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """http.client connection that speaks HTTP over a unix domain socket."""
+
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self._socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+class DockerApiClient:
+    """Minimal persistent client for the local Docker Engine API.
+
+    The docker CLI pays ~100ms of process startup per invocation; for the
+    small JSON queries this script repeats (image/container inspect) one
+    keep-alive connection to /var/run/docker.sock answers in microseconds.
+    Callers fall back to the CLI when the socket is unavailable (Windows
+    named pipes, remote daemons).
+    """
+
+    SOCKET_PATH = "/var/run/docker.sock"
+
+    def __init__(self):
+        self._conn = None
+
+    def available(self):
+        return not IS_WINDOWS and os.path.exists(self.SOCKET_PATH)
+
+    def get(self, path):
+        """GETs an API path; returns (status, parsed JSON or None).
+
+        Returns None (instead of a tuple) when the API is unreachable so
+        callers can distinguish "daemon said 404" from "no socket".
+        """
+        if not self.available():
+            return None
+        try:
+            if self._conn is None:
+                self._conn = _UnixHTTPConnection(self.SOCKET_PATH)
+            self._conn.request("GET", path)
+            response = self._conn.getresponse()
+            body = response.read()
+            payload = json.loads(body) if response.status == 200 else None
+            return response.status, payload
+        except (OSError, http.client.HTTPException, ValueError):
+            self.close()
+            return None
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+
+# 스크립트 수명 동안 연결을 재사용하는 싱글턴
+docker_api = DockerApiClient()
+
 # --- Helper Functions ---
-def run_command(command, check=True, env=None, **kwargs):
-    """Runs a shell command and optionally checks for errors."""
-    print(f"\n---> Running command: {' '.join(command)}")
-    
-    # Prepare environment variables
-    cmd_env = os.environ.copy()
-    if env:
-        cmd_env.update(env)
-    
+# 호출할 때마다 전체 환경을 복사하지 않도록 시작 시 한 번만 스냅샷
+_BASE_ENV = os.environ.copy()
+
+def _pump_output(pipe):
+    """Forwards subprocess output line by line from a background thread,
+    so the Python-side write syscalls overlap the child's work instead of
+    blocking it on a full pipe."""
+    for line in iter(pipe.readline, ''):
+        sys.stdout.write(line)
+    pipe.close()
+
+def run_command(command, check=True, env=None, stream=False, **kwargs):
+    """Runs a shell command and optionally checks for errors.
+
+    With stream=True the child's output is piped through a background
+    thread instead of inheriting stdout; used for the long docker build.
+    """
+    log.info(f"\n---> Running command: {' '.join(command)}")
+
+    # Prepare environment variables (오버라이드가 있을 때만 새 dict 생성)
+    cmd_env = {**_BASE_ENV, **env} if env else _BASE_ENV
+
     try:
-        # Use shell=True on Windows if needed, but avoid if possible
-        use_shell = sys.platform == "win32"
+        # shell=False로 리스트 인자를 그대로 전달 (Windows 포함).
+        # 셸을 거치면 cmd.exe 기동 비용과 인용 문제가 추가될 뿐임.
+        if stream:
+            proc = subprocess.Popen(command, text=True, env=cmd_env,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, **kwargs)
+            pump = threading.Thread(target=_pump_output, args=(proc.stdout,), daemon=True)
+            pump.start()
+            returncode = proc.wait()
+            pump.join()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, command)
+            log.info(f"---> Command successful.")
+            return True
         # Pass the 'check' argument received by the function
-        result = subprocess.run(command, check=check, text=True, shell=use_shell, env=cmd_env, **kwargs)
-        print(f"---> Command successful.")
+        result = subprocess.run(command, check=check, text=True, env=cmd_env, **kwargs)
+        log.info(f"---> Command successful.")
         return True
     except subprocess.CalledProcessError as e:
         # Only print error if check=True
         if check:
-            print(f"ERROR: Command failed with exit code {e.returncode}", file=sys.stderr)
-            print(f"ERROR details: {e}", file=sys.stderr)
+            log.error(f"ERROR: Command failed with exit code {e.returncode}")
+            log.error(f"ERROR details: {e}")
         else:
             # Optionally log non-fatal errors when check=False
-            print(f"---> Command finished with non-zero exit code {e.returncode} (check=False, ignored).")
+            log.info(f"---> Command finished with non-zero exit code {e.returncode} (check=False, ignored).")
         # Return False only if check=True caused the exception
         return not check
     except FileNotFoundError:
-        print(f"ERROR: Command not found: {command[0]}", file=sys.stderr)
-        print("Ensure Docker CLI is installed and in your PATH.", file=sys.stderr)
+        log.error(f"ERROR: Command not found: {command[0]}\n"
+                  "Ensure Docker CLI is installed and in your PATH.")
         return False
 
-def prepare_dockerignore_for_test():
-    """Backs up .dockerignore and replaces it with the test version if needed."""
-    print("Preparing .dockerignore for TEST build...")
-    backup_made = False
-    # Cleanup any lingering backup
-    if os.path.exists(BACKUP_DOCKERIGNORE):
-        try:
-            os.remove(BACKUP_DOCKERIGNORE)
-        except OSError as e:
-            print(f"WARNING: Could not remove lingering backup {BACKUP_DOCKERIGNORE}: {e}", file=sys.stderr)
+# 빌드 컨텍스트가 불필요하게 커지는 것을 막기 위해
+# .dockerignore에 반드시 포함되어야 하는 항목들
+REQUIRED_DOCKERIGNORE_ENTRIES = (".git/", "build/", ".venv/", "__pycache__/")
 
-    if not os.path.exists(TEST_DOCKERIGNORE):
-        print(f"WARNING: {TEST_DOCKERIGNORE} not found. Build will use {DEFAULT_DOCKERIGNORE} (if it exists).")
-        return False # Indicate no backup needed
+def verify_dockerignore(ignore_file, strict=False):
+    """Warns when the ignore file seems to miss context-critical entries.
 
-    if os.path.exists(DEFAULT_DOCKERIGNORE):
-        print(f"  Backing up {DEFAULT_DOCKERIGNORE} to {BACKUP_DOCKERIGNORE}")
-        try:
-            shutil.move(DEFAULT_DOCKERIGNORE, BACKUP_DOCKERIGNORE)
-            backup_made = True
-        except OSError as e:
-            print(f"ERROR: Failed to backup {DEFAULT_DOCKERIGNORE}: {e}", file=sys.stderr)
-            raise # Re-raise the exception to stop the process
+    A dropped '.git/' or 'build/' entry silently balloons the build context
+    and invalidates layer caching, so flag it before the build starts. The
+    check is an exact-token heuristic (a reorganized file can cover the same
+    paths with different patterns), so by default a miss is only a loud
+    warning; pass strict=True (--strict-ignore) to abort the build instead.
+    """
+    if not os.path.exists(ignore_file):
+        log.error(f"ERROR: {ignore_file} not found; the entire directory would be sent as build context.")
+        sys.exit(1)
+    with open(ignore_file) as f:
+        # 주석 줄은 건너뛰고, 패턴 뒤에 붙은 인라인 주석은 무시
+        entries = {line.split()[0] for line in f
+                   if line.strip() and not line.lstrip().startswith("#")}
+    missing = [e for e in REQUIRED_DOCKERIGNORE_ENTRIES if e not in entries]
+    if missing:
+        message = (f"{ignore_file} may be missing required entries: {', '.join(missing)}\n"
+                   "       Without them the build context (and cache keys) can balloon.")
+        if strict:
+            log.error(f"ERROR: {message}")
+            sys.exit(1)
+        log.warning(f"WARNING: {message}")
 
-    print(f"  Copying {TEST_DOCKERIGNORE} to {DEFAULT_DOCKERIGNORE}...")
+def find_env_file():
+    """Returns the first existing env file from the candidate list, or None.
+
+    One os.scandir of the working directory replaces a stat call per
+    candidate; only candidates outside the working directory (e.g.
+    '../server-config.env') still need an individual check.
+    """
     try:
-        shutil.copy2(TEST_DOCKERIGNORE, DEFAULT_DOCKERIGNORE) # copy2 preserves metadata
-    except OSError as e:
-        print(f"ERROR: Failed to copy {TEST_DOCKERIGNORE} to {DEFAULT_DOCKERIGNORE}: {e}", file=sys.stderr)
-        # Attempt to restore backup if one was made
-        if backup_made:
-            try:
-                shutil.move(BACKUP_DOCKERIGNORE, DEFAULT_DOCKERIGNORE)
-            except OSError as re:
-                print(f"ERROR: Failed to restore backup {BACKUP_DOCKERIGNORE}: {re}", file=sys.stderr)
-        raise # Re-raise the exception
+        local_names = {entry.name for entry in os.scandir(".")}
+    except OSError:
+        local_names = set()
+    for env_path in (ENV_FILE_PATH, *ENV_FILE_ALTERNATIVES):
+        if os.path.dirname(env_path):
+            if os.path.exists(env_path):
+                return env_path
+        elif env_path in local_names:
+            return env_path
+    return None
+
+def compute_context_hash(dockerfile, extra_tokens=()):
+    """Hashes the Dockerfile and every build input that feeds the image.
+
+    Walks the source trees in a deterministic order so the digest only
+    changes when an input file actually changes. Used to skip rebuilds
+    when nothing the Dockerfile consumes has been touched.
+    """
+    digest = hashlib.sha256()
+    for token in extra_tokens:
+        digest.update(token.encode())
+    inputs = [dockerfile]
+    inputs.extend(CONTEXT_HASH_FILES)
+    for root in CONTEXT_HASH_DIRS:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                inputs.append(os.path.join(dirpath, name))
+    for path in inputs:
+        if not os.path.isfile(path):
+            continue
+        digest.update(path.encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def image_exists(image_tag):
+    """Returns True if the image tag is present in the local daemon."""
+    response = docker_api.get(f"/images/{urllib.parse.quote(image_tag, safe='')}/json")
+    if response is not None:
+        return response[0] == 200
+    # API 소켓을 쓸 수 없는 환경에서는 CLI로 폴백
+    result = subprocess.run(
+        ["docker", "image", "inspect", image_tag],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return result.returncode == 0
 
-    return backup_made
+def pull_cache_image(image_tag):
+    """Pulls a previously pushed image so its layers can seed --cache-from.
 
-def restore_dockerignore(backup_made):
-    """Restores the original .dockerignore file."""
-    print("Restoring .dockerignore...")
-    if backup_made:
+    Returns True when the pull succeeded (the tag exists locally or in a
+    reachable registry), False otherwise. Failures are expected on the very
+    first build and are silently ignored.
+    """
+    log.info(f"---> Pulling '{image_tag}' to warm the build cache (failure is OK on first build)...")
+    result = subprocess.run(
+        ["docker", "pull", image_tag],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return result.returncode == 0
+
+def get_container_state(container_name):
+    """Fetches the container's State object with a single inspect call.
+
+    One inspect answers what 'docker ps', 'docker exec curl /health' and
+    a status table used to take three subprocesses for: run state plus
+    the HEALTHCHECK result the daemon already maintains. Returns None if
+    the container does not exist.
+    """
+    response = docker_api.get(f"/containers/{container_name}/json")
+    if response is not None:
+        status, payload = response
+        return (payload or {}).get("State") if status == 200 else None
+    # API 소켓이 없으면 CLI inspect 한 번으로 동일 정보 조회
+    try:
+        result = subprocess.run(
+            ["docker", "inspect", "--format", "{{json .State}}", container_name],
+            capture_output=True, text=True
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+def wait_for_container_ready(container_name, timeout=30.0):
+    """Polls the /health endpoint with exponential backoff until it answers.
+
+    Hitting the published port directly reports readiness as soon as the
+    server listens; the image HEALTHCHECK (interval 10s) would keep
+    State.Health at "starting" for a full interval first. Starting at
+    0.5s means a fast-starting container is not stuck behind a fixed
+    sleep, while the cap keeps a slow t2.micro start from being hammered
+    with polls. A probe miss falls back to one inspect so a crashed
+    container fails on the next poll instead of burning the timeout.
+    """
+    health_url = f"http://localhost:{HOST_PORT_HTTP}/health"
+    deadline = time.monotonic() + timeout
+    delay = 0.5
+    while True:
         try:
-            if os.path.exists(DEFAULT_DOCKERIGNORE):
-                os.remove(DEFAULT_DOCKERIGNORE)
-            shutil.move(BACKUP_DOCKERIGNORE, DEFAULT_DOCKERIGNORE)
-            print(f"  Restored {DEFAULT_DOCKERIGNORE} from {BACKUP_DOCKERIGNORE}")
-        except OSError as e:
-            print(f"WARNING: Failed to restore {DEFAULT_DOCKERIGNORE} from backup: {e}", file=sys.stderr)
-    else:
-        # If we copied the test file but no original existed, remove the copied one
-        # We check if the copied file *is* the test one by comparing content (more robust than just existence)
-        copied_is_test = False
-        if os.path.exists(DEFAULT_DOCKERIGNORE) and os.path.exists(TEST_DOCKERIGNORE):
-            try:
-                # Simple content check (may fail for large files, but okay for ignore files)
-                 with open(DEFAULT_DOCKERIGNORE, 'r') as f1, open(TEST_DOCKERIGNORE, 'r') as f2:
-                     if f1.read() == f2.read():
-                         copied_is_test = True
-            except IOError as e:
-                 print(f"WARNING: Could not compare ignore files: {e}", file=sys.stderr)
+            with urllib.request.urlopen(health_url, timeout=3) as response:
+                if 200 <= response.status < 300:
+                    return True
+        except OSError:
+            pass
+        # 응답이 없으면 컨테이너가 이미 죽었는지 확인 후 재시도
+        state = get_container_state(container_name)
+        if state and state.get("Status") == "exited":
+            return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 8.0)
+
+def rotate_buildx_cache(cache_dir):
+    """Promotes the freshly written buildx cache and drops the old one.
+
+    Writing to <cache_dir>-new and swapping after a successful build
+    keeps the cache directory from growing without bound across builds.
+    The directory is per target so app and test rotations cannot evict
+    each other's layers.
+    """
+    new_dir = cache_dir + "-new"
+    if os.path.isdir(new_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.rename(new_dir, cache_dir)
+
+# --- Build Plan ---
+@dataclasses.dataclass
+class BuildPlan:
+    """Everything one build/run cycle needs, resolved once from the CLI args.
+
+    Collapses the argparse namespace, the env-file probing and the
+    build/run argument assembly into a single object, so main only has
+    to sequence docker calls against it.
+    """
+    target: str
+    platform: str
+    push: bool
+    refresh_base: bool
+    bake: bool
+    image_tag: str
+    dockerfile: str
+    cache_ref: str
+    cache_dir: str
+    hash_file: str
+    build_args: list
+    build_env: dict
+    run_args: list
+    container_name: str = None  # app 타겟에서만 설정
+
+    @property
+    def runs_locally(self):
+        """push/멀티 아치 빌드는 이미지를 로컬 데몬에 로드하지 않음"""
+        return not self.push and self.platform != "both"
+
+    @classmethod
+    def from_args(cls, args):
+        # Platform 설정
+        target_platform = args.platform
+        if target_platform == "auto":
+            target_platform = get_current_arch()
+            log.info(f"Auto-detected platform: {target_platform}")
+        platform_spec = ("linux/amd64,linux/arm64" if target_platform == "both"
+                         else f"linux/{target_platform}")
 
-        if copied_is_test:
-             print(f"  Removing temporary {DEFAULT_DOCKERIGNORE} (copied from {TEST_DOCKERIGNORE})...")
-             try:
-                 os.remove(DEFAULT_DOCKERIGNORE)
-             except OSError as e:
-                 print(f"WARNING: Failed to remove temporary {DEFAULT_DOCKERIGNORE}: {e}", file=sys.stderr)
+        # --- Prepare Environment based on Target ---
+        if args.target == "test":
+            image_tag = TEST_IMAGE_TAG
+            dockerfile = TEST_DOCKERFILE
+            container_name = None
+            # BuildKit이 테스트 빌드에 실제로 사용하는 ignore 파일을 검사
+            verify_dockerignore(TEST_DOCKERIGNORE, strict=args.strict_ignore)
+            run_args = list(TEST_RUN_ARGS)
+        else:  # app mode
+            image_tag = APP_IMAGE_TAG
+            dockerfile = APP_DOCKERFILE
+            container_name = APP_CONTAINER_NAME
+            verify_dockerignore(DEFAULT_DOCKERIGNORE, strict=args.strict_ignore)
+
+            # 정적 옵션(리소스 제한/로그 드라이버/포트 매핑)은 모듈 로드 시
+            # 조립된 APP_RUN_ARGS_BASE를 복사해 사용
+            run_args = list(APP_RUN_ARGS_BASE)
 
+            # 환경 변수 파일 찾기 (디렉터리 한 번만 스캔)
+            env_path = find_env_file()
+            if env_path:
+                log.info(f"Found environment file: {env_path}")
+                run_args.extend(["--env-file", env_path])
+            else:
+                log.warning(f"WARNING: No environment file found. Checked: {[ENV_FILE_PATH] + ENV_FILE_ALTERNATIVES}")
+                log.info("Container will run without environment file.")
+            run_args.append(image_tag)
+
+        # 레지스트리 프리픽스가 주어지면 같은 buildx 호출 안에서
+        # 레지스트리용 태그까지 함께 부여 (별도 tag/push 단계 불필요).
+        # 캐시 소스로는 레지스트리 태그가 있으면 그것을 우선 사용.
+        registry_tag = f"{args.registry}/{image_tag}" if args.registry else None
+        cache_ref = registry_tag or image_tag
+        # 타겟별 로컬 캐시 디렉터리 (해시 파일과 같은 per-target 구조)
+        cache_dir = os.path.join(BUILDX_CACHE_DIR, args.target)
+
+        # Docker BuildKit 활성화를 위한 환경 변수
+        build_env = {"DOCKER_BUILDKIT": "1"}
+
+        if args.bake:
+            # --- docker buildx bake로 위임 (선택) ---
+            # 플래그를 일일이 조립하는 대신 docker-bake.hcl의 타겟 정의를 사용.
+            # 태그/플랫폼/캐시 설정은 HCL 쪽에 동일하게 정의되어 있고,
+            # 변수(REGISTRY, PLATFORMS 등)는 환경 변수로 전달됨.
+            build_args = ["docker", "buildx", "bake", "-f", "docker-bake.hcl", args.target]
+            if args.push:
+                build_args.append("--push")
+            elif target_platform != "both":
+                build_args.append("--load")
+            if args.refresh_base:
+                build_args.append("--pull")
+            build_env["PLATFORMS"] = platform_spec
+            if args.registry:
+                build_env["REGISTRY"] = args.registry
+            if args.target == "app":
+                build_env["VCPKG_MAX_CONCURRENCY"] = "1"  # t2.micro 메모리 보호
+        else:
+            build_args = ["docker", "buildx", "build",
+                          "--platform", platform_spec,
+                          "-t", image_tag, "-f", dockerfile]
+            if registry_tag:
+                build_args.extend(["-t", registry_tag])
+
+            # Multi-arch build는 push 없이는 로컬에 로드할 수 없음
+            if args.push:
+                build_args.extend(["--push", "."])
+            elif target_platform == "both":
+                log.warning("WARNING: Multi-arch build without push will not load images locally")
+                build_args.append(".")
+            else:
+                build_args.extend(["--load", "."])
+
+            # t2.micro에서 빌드 시 메모리 부족 방지
+            if args.target == "app":
+                build_args.extend([
+                    "--build-arg", "VCPKG_MAX_CONCURRENCY=1",  # 병렬 빌드 제한
+                ])
+                # ARM64 빌드를 위한 추가 설정
+                if target_platform in ["arm64", "both"]:
+                    build_args.extend([
+                        "--build-arg", "ENABLE_ARM64_OPTIMIZATIONS=1"
+                    ])
+
+            # 베이스 이미지 갱신은 명시적으로 요청했을 때만 수행
+            if args.refresh_base:
+                build_args.append("--pull")
+
+            # 인라인 캐시 메타데이터를 이미지에 포함시켜, 푸시된 이미지가
+            # 다른 머신(콜드 CI 러너 등)에서 --cache-from 소스로 쓰일 수 있게 함
+            build_args.extend(["--build-arg", "BUILDKIT_INLINE_CACHE=1"])
+            if args.push:
+                build_args.extend([
+                    "--cache-to=type=inline",
+                    f"--cache-from=type=registry,ref={cache_ref}",
+                ])
+
+            # 레이어 캐시를 로컬 디렉터리에도 기록 (데몬이 초기화되는 환경 대비)
+            if os.path.isdir(cache_dir):
+                build_args.append(f"--cache-from=type=local,src={cache_dir}")
+            build_args.append(f"--cache-to=type=local,dest={cache_dir}-new,mode=max")
+
+        # 빌드 진행 상황을 표시하기 위해 --progress=plain 추가
+        build_args.append("--progress=plain")
+
+        return cls(
+            target=args.target,
+            platform=target_platform,
+            push=args.push,
+            refresh_base=args.refresh_base,
+            bake=args.bake,
+            image_tag=image_tag,
+            dockerfile=dockerfile,
+            cache_ref=cache_ref,
+            cache_dir=cache_dir,
+            hash_file=f"{BUILD_HASH_FILE_PREFIX}.{args.target}",
+            build_args=build_args,
+            build_env=build_env,
+            run_args=run_args,
+            container_name=container_name,
+        )
 
 # --- Main Script Logic ---
 def main():
@@ -163,222 +588,168 @@ def main():
     parser.add_argument(
         "--push",
         action="store_true",
-        help="Push multi-arch images to registry (requires --platform=both)"
+        help="Push the built image(s) to the registry in the same buildx call. "
+             "With --platform=both the per-arch builds run in parallel under "
+             "one invocation; single-arch pushes work too."
+    )
+    parser.add_argument(
+        "--registry",
+        default=None,
+        help="Registry prefix (e.g. 'ghcr.io/kugorang'). The image is additionally "
+             "tagged as <registry>/<image> in the same buildx call, so tag+push "
+             "needs no separate 'docker tag'/'docker push' steps."
+    )
+    parser.add_argument(
+        "--refresh-base",
+        action="store_true",
+        help="Force re-pulling base images during the build (adds 'docker build --pull')."
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Only print warnings and errors (suppresses progress chatter)."
+    )
+    parser.add_argument(
+        "--strict-ignore",
+        action="store_true",
+        help="Abort the build when the .dockerignore check finds a missing "
+             "required entry (by default it only warns, since the check is "
+             "an exact-match heuristic)."
+    )
+    parser.add_argument(
+        "--bake",
+        action="store_true",
+        help="Build via the 'app'/'test' targets in docker-bake.hcl instead of "
+             "assembling 'docker buildx build' flags here."
     )
     args = parser.parse_args()
-    
-    # Platform 설정
-    if args.platform == "auto":
-        args.platform = get_current_arch()
-        print(f"Auto-detected platform: {args.platform}")
-    
-    # Multi-arch push는 'both' platform에서만 가능
-    if args.push and args.platform != "both":
-        print("ERROR: --push requires --platform=both", file=sys.stderr)
-        sys.exit(1)
+    configure_logging(args.quiet)
 
-    # Docker BuildKit 활성화를 위한 환경 변수
-    build_env = {"DOCKER_BUILDKIT": "1"}
-    
-    backup_made = False
-    try:
-        # --- Prepare Environment based on Target ---
-        if args.target == "test":
-            print("--- Running in TEST mode ---")
-            image_tag = TEST_IMAGE_TAG
-            dockerfile = TEST_DOCKERFILE
-            backup_made = prepare_dockerignore_for_test()
-            # Platform 옵션 추가
-            platform_opts = []
-            if args.platform == "both":
-                platform_opts = ["--platform", "linux/amd64,linux/arm64"]
-            else:
-                platform_opts = ["--platform", f"linux/{args.platform}"]
-            
-            build_args = ["docker", "buildx", "build"] + platform_opts + ["-t", image_tag, "-f", dockerfile]
-            
-            # Multi-arch build는 push 없이는 로컬에 로드할 수 없음
-            if args.platform == "both":
-                if args.push:
-                    build_args.extend(["--push", "."])
-                else:
-                    print("WARNING: Multi-arch build without push will not load images locally")
-                    build_args.append(".")
-            else:
-                build_args.extend(["--load", "."])
-            
-            run_args = ["docker", "run", "--rm", "-e", "GOOGLE_MAPS_API_KEY=dummy_key", image_tag]
-        else: # app mode
-            print("--- Running in APPLICATION mode ---")
-            image_tag = APP_IMAGE_TAG
-            dockerfile = APP_DOCKERFILE
-            container_name = APP_CONTAINER_NAME
+    log.info(f"--- Running in {'TEST' if args.target == 'test' else 'APPLICATION'} mode ---")
+    plan = BuildPlan.from_args(args)
+
+    # 서로 독립적인 docker 준비 작업(컨테이너 정리, 캐시 워밍 풀)을
+    # 빌드 인자 조립/빌더 부트스트랩과 겹치기 위한 작업 풀
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    teardown_future = None
 
+    try:
+        if plan.container_name:
             # Stop and remove existing app container
-            print(f"Stopping and removing existing container '{container_name}' (if any)...")
-            run_command(["docker", "kill", container_name], stderr=subprocess.DEVNULL, check=False) # Ignore errors if container doesn't exist
-            run_command(["docker", "rm", container_name], stderr=subprocess.DEVNULL, check=False)    # Ignore errors if container doesn't exist
-
-            # Platform 옵션 추가
-            platform_opts = []
-            if args.platform == "both":
-                platform_opts = ["--platform", "linux/amd64,linux/arm64"]
-            else:
-                platform_opts = ["--platform", f"linux/{args.platform}"]
-            
-            build_args = ["docker", "buildx", "build"] + platform_opts + ["-t", image_tag, "-f", dockerfile]
-            
-            # Multi-arch build는 push 없이는 로컬에 로드할 수 없음
-            if args.platform == "both":
-                if args.push:
-                    build_args.extend(["--push", "."])
-                else:
-                    print("WARNING: Multi-arch build without push will not load images locally")
-                    build_args.append(".")
-            else:
-                build_args.extend(["--load", "."])
+            # 'rm -f'가 kill+rm을 데몬 호출 한 번으로 처리하고,
+            # 결과는 새 컨테이너를 띄우기 직전에만 필요하므로 백그라운드로 수행
+            log.info(f"Stopping and removing existing container '{plan.container_name}' (if any)...")
+            teardown_future = pool.submit(
+                run_command, ["docker", "rm", "-f", plan.container_name],
+                stderr=subprocess.DEVNULL, check=False) # Ignore errors if container doesn't exist
 
-            # Prepare run args for app
-            run_args_list = ["docker", "run", "-d", "--name", container_name]
-            
-            # t2.micro 환경을 위한 리소스 제한
-            # 1GB RAM 중 시스템용 100MB 제외하고 900MB 할당
-            resource_limits = [
-                "--memory", "900m",
-                "--memory-swap", "900m",  # swap 비활성화 (성능 저하 방지)
-                "--cpus", "0.95"  # CPU의 95% 사용 (시스템 여유분 확보)
-            ]
-            run_args_list.extend(resource_limits)
-            
-            # ECS t2.micro 환경에서 추가 설정
-            if IS_T2_MICRO:
-                ecs_options = [
-                    "--privileged",  # WSL2/ECS libevent 문제 해결
-                    "--log-driver", "awslogs",
-                    "--log-opt", f"awslogs-group=/ecs/cherryrecorder-server",
-                    "--log-opt", f"awslogs-region=ap-northeast-2",
-                    "--log-opt", f"awslogs-stream=local-test",
-                    "--restart", "unless-stopped"
-                ]
-                run_args_list.extend(ecs_options)
-            else:
-                # 로컬 개발 환경에서는 json-file 사용
-                local_options = [
-                    "--log-driver", "json-file",
-                    "--log-opt", "max-size=10m",
-                    "--log-opt", "max-file=3"
-                ]
-                run_args_list.extend(local_options)
-            
-            port_map_options = [
-                "-p", f"{HOST_PORT_HTTP}:{CONTAINER_PORT_HTTP}",
-                "-p", f"{HOST_PORT_CHAT}:{CONTAINER_PORT_CHAT}"
-            ]
-            run_args_list.extend(port_map_options)
-
-            # 환경 변수 파일 찾기
-            env_file_found = False
-            for env_path in [ENV_FILE_PATH] + ENV_FILE_ALTERNATIVES:
-                if os.path.exists(env_path):
-                    print(f"Found environment file: {env_path}")
-                    run_args_list.extend(["--env-file", env_path])
-                    env_file_found = True
-                    break
-            
-            if not env_file_found:
-                print(f"WARNING: No environment file found. Checked: {[ENV_FILE_PATH] + ENV_FILE_ALTERNATIVES}")
-                print("Container will run without environment file.")
-
-            run_args_list.append(image_tag)
-            run_args = run_args_list
-
-
-        # --- Setup Docker Buildx (for multi-arch) ---
-        if args.platform == "both" or args.platform == "arm64":
-            print("Setting up Docker Buildx for multi-architecture build...")
+        # --- 변경 없는 재빌드 건너뛰기 ---
+        # Dockerfile과 빌드 입력이 지난 성공 빌드와 동일하고 이미지가 이미
+        # 로컬 데몬에 있으면 docker 빌드 자체를 생략 (푸시/베이스 갱신 제외)
+        context_hash = compute_context_hash(plan.dockerfile, extra_tokens=(plan.platform,))
+        skip_build = False
+        if not plan.push and not plan.refresh_base and image_exists(plan.image_tag):
+            try:
+                with open(plan.hash_file) as f:
+                    skip_build = f.read().strip() == context_hash
+            except OSError:
+                pass
+
+        # 캐시 워밍 풀을 백그라운드로 시작해 빌더 부트스트랩 및
+        # 나머지 준비 작업과 겹침. bake 모드에서는 캐시 소스가 HCL에
+        # 선언되어 있고 'bake'에 --cache-from 플래그가 없으므로 생략.
+        pull_future = (pool.submit(pull_cache_image, plan.cache_ref)
+                       if not skip_build and not plan.bake else None)
+
+        # --- Setup Docker Buildx ---
+        # 멀티 아치뿐 아니라 로컬 캐시 내보내기(--cache-to=type=local)도
+        # 기본 'docker' 드라이버로는 동작하지 않으므로, 빌드를 실제로
+        # 수행할 때는 항상 docker-container 드라이버 빌더를 사용
+        if not skip_build:
+            log.info("Setting up Docker Buildx builder...")
             # Create and use buildx builder
             builder_name = "cherryrecorder-builder"
             run_command(["docker", "buildx", "create", "--name", builder_name, "--use"], check=False)
             run_command(["docker", "buildx", "inspect", "--bootstrap"])
-        
+
         # --- Build Docker Image ---
-        print("INFO: Docker BuildKit is enabled for improved caching performance.")
-        print(f"INFO: Building for platform(s): {args.platform}")
-        print("INFO: First build may take 20-30 minutes to compile all dependencies.")
-        print("INFO: Subsequent builds will be much faster due to caching.")
-        
-        # t2.micro에서 빌드 시 메모리 부족 방지
-        if args.target == "app":
-            print("INFO: Building on t2.micro - using memory-optimized settings.")
-            build_args.extend([
-                "--build-arg", "VCPKG_MAX_CONCURRENCY=1",  # 병렬 빌드 제한
-                # 빌드 시에는 메모리 제한 제거 (빌드 실패 방지)
-                # "--memory", "900m",  
-            ])
-            
-            # ARM64 빌드를 위한 추가 설정
-            if args.platform in ["arm64", "both"]:
-                build_args.extend([
-                    "--build-arg", "ENABLE_ARM64_OPTIMIZATIONS=1"
-                ])
-        
-        # 빌드 진행 상황을 표시하기 위해 --progress=plain 추가
-        build_args.extend(["--progress=plain"])
-        
-        if not run_command(build_args, env=build_env):
-            sys.exit(1) # Exit if build fails
+        # 여러 줄 안내문은 한 번의 로그 호출(=한 번의 write)로 내보냄
+        log.info("INFO: Docker BuildKit is enabled for improved caching performance.\n"
+                 f"INFO: Building for platform(s): {plan.platform}\n"
+                 "INFO: First build may take 20-30 minutes to compile all dependencies.\n"
+                 "INFO: Subsequent builds will be much faster due to caching.")
+
+        # 이전에 빌드/푸시된 이미지를 받아와 레이어 캐시로 재사용
+        # (코드만 변경된 경우 의존성 컴파일 레이어를 통째로 건너뛸 수 있음)
+        if pull_future is not None and pull_future.result():
+            plan.build_args.extend(["--cache-from", plan.cache_ref])
+
+        if skip_build:
+            log.info(f"INFO: Build inputs unchanged since the last build; reusing image '{plan.image_tag}'.")
+        else:
+            if not run_command(plan.build_args, env=plan.build_env, stream=True):
+                sys.exit(1) # Exit if build fails
+            rotate_buildx_cache(plan.cache_dir)
+            with open(plan.hash_file, "w") as f:
+                f.write(context_hash + "\n")
 
         # --- Run Docker Container ---
-        # Multi-arch build without push는 실행할 수 없음
-        if args.platform == "both" and not args.push:
-            print("\nMulti-arch build completed (not loaded locally).")
-            print("To push images: re-run with --push flag")
+        # push/멀티 아치 빌드는 이미지를 로컬에 로드하지 않으므로 실행 단계를 건너뜀
+        if plan.push:
+            log.info(f"\nImage(s) pushed for platform(s) {plan.platform} (not loaded locally).")
+        elif plan.platform == "both":
+            log.info("\nMulti-arch build completed (not loaded locally).\n"
+                     "To push images: re-run with --push flag")
         else:
-            if not run_command(run_args):
-                 print(f"ERROR: Docker run failed or tests failed for target '{args.target}'!", file=sys.stderr)
+            # 새 컨테이너를 띄우기 전에 기존 컨테이너 제거가 끝났는지 확인
+            if teardown_future is not None:
+                teardown_future.result()
+            if not run_command(plan.run_args):
+                 log.error(f"ERROR: Docker run failed or tests failed for target '{plan.target}'!")
                  sys.exit(1) # Exit if run/tests fail
 
         # --- Post-run messages ---
-        if args.target == "app":
-            print(f"\nContainer '{APP_CONTAINER_NAME}' started successfully.")
-            print(f"  To view logs: docker logs {APP_CONTAINER_NAME} -f")
-            print(f"  To stop:      docker kill {APP_CONTAINER_NAME}")
-            
-            # 헬스체크 수행 (5초 대기 후)
-            print("\nWaiting for container to be ready...")
-            time.sleep(5)
-            
-            # 컨테이너 상태 확인
-            print("\nContainer status:")
-            check_cmd = ["docker", "ps", "--filter", f"name={APP_CONTAINER_NAME}", "--format", "table {{.Status}}"]
-            run_command(check_cmd)
-            
-            # 헬스체크 엔드포인트 테스트
-            print("\nTesting health endpoint...")
-            health_cmd = ["docker", "exec", APP_CONTAINER_NAME, "curl", "-f", "http://localhost:8080/health"]
-            if run_command(health_cmd, check=False):
-                print("✓ Health check passed!")
+        # 컨테이너가 실제로 실행된 경우에만 상태/헬스 안내 출력
+        if plan.target == "app" and plan.runs_locally:
+            log.info(f"\nContainer '{plan.container_name}' started successfully.\n"
+                     f"  To view logs: docker logs {plan.container_name} -f\n"
+                     f"  To stop:      docker kill {plan.container_name}")
+
+            # 헬스체크: 고정 5초 대기 대신 지수 백오프로 준비될 때까지 폴링
+            log.info("\nWaiting for container to be ready...")
+            ready = wait_for_container_ready(plan.container_name)
+
+            # 컨테이너 상태 확인 (docker ps 대신 inspect 결과 재사용)
+            log.info("\nContainer status:")
+            state = get_container_state(plan.container_name)
+            if state:
+                health = (state.get("Health") or {}).get("Status")
+                log.info(f"  Status: {state.get('Status')}"
+                         + (f" (health: {health})" if health else ""))
             else:
-                print("✗ Health check failed - server may still be starting up.")
-                print("  Check logs with: docker logs " + APP_CONTAINER_NAME)
-            
+                log.warning(f"WARNING: Could not inspect container '{plan.container_name}'.")
+
+            if ready:
+                log.info("✓ Health check passed!")
+            else:
+                log.info("✗ Health check failed - server may still be starting up.\n"
+                         "  Check logs with: docker logs " + plan.container_name)
+
             # t2.micro 환경에서 리소스 사용량 표시
             if IS_T2_MICRO:
-                print("\n--- Resource Usage (t2.micro) ---")
-                stats_cmd = ["docker", "stats", "--no-stream", "--format", "table {{.Container}}\t{{.CPUPerc}}\t{{.MemUsage}}", APP_CONTAINER_NAME]
+                log.info("\n--- Resource Usage (t2.micro) ---")
+                stats_cmd = ["docker", "stats", "--no-stream", "--format", "table {{.Container}}\t{{.CPUPerc}}\t{{.MemUsage}}", plan.container_name]
                 run_command(stats_cmd)
-        else:
-            print("\nTests completed successfully.")
+        elif plan.target == "test" and plan.runs_locally:
+            log.info("\nTests completed successfully.")
 
-        print("\nScript finished.")
+        log.info("\nScript finished.")
 
     except Exception as e:
-        print(f"\nAn unexpected error occurred: {e}", file=sys.stderr)
+        log.error(f"\nAn unexpected error occurred: {e}")
         sys.exit(1)
     finally:
-        # --- Ensure .dockerignore is restored ---
-        if args.target == "test": # Only restore if we potentially modified it
-             restore_dockerignore(backup_made)
+        pool.shutdown(wait=True)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()